@@ -1,13 +1,160 @@
 '''
 Analysis utilities for flow analysis
 '''
-import ROOT
+# ROOT, uproot and ctypes are imported in the functions that need them, so that
+# the pure python helpers can be used without loading them
 import os
 import sys
-import ctypes
+import functools
+import re
+from collections import defaultdict
 from itertools import combinations
 import numpy as np
 
+_HIST_ARRAY_DTYPES = {
+    'TArrayD': np.float64,
+    'TArrayF': np.float32,
+    'TArrayI': np.int32,
+    'TArrayS': np.int16,
+    'TArrayC': np.int8,
+}
+
+_RESO_DETS = ['FT0c', 'FT0a', 'FV0a', 'TPCpos', 'FT0m', 'TPCneg']
+# patterns of the resolution pair names with a known detector A at the start or at the end
+_RESO_PAIR_PATTERNS = {
+    prefix: tuple(re.compile(pattern.format(prefix=prefix, dets='|'.join(map(re.escape, _RESO_DETS))))
+                  for pattern in (r'^{prefix}(?P<detA>{dets})(?P<det>.+)$', r'^{prefix}(?P<det>.+)(?P<detA>{dets})$'))
+    for prefix in ('hSpReso', 'hEpReso')
+}
+
+_CENT_BINS = {
+    'k010': ('0_10', [0, 10]),
+    'k020': ('0_20', [0, 20]),
+    'k2030': ('20_30', [20, 30]),
+    'k3040': ('30_40', [30, 40]),
+    'k3050': ('30_50', [30, 50]),
+    'k4050': ('40_50', [40, 50]),
+    'k2060': ('20_60', [20, 60]),
+    'k4060': ('40_60', [40, 60]),
+    'k6070': ('60_70', [60, 70]),
+    'k6080': ('60_80', [60, 80]),
+    'k7080': ('70_80', [70, 80]),
+    'k0100': ('0_100', [0, 100]),
+}
+
+def get_hist_array(histo, sumw2=False):
+    '''
+    Get the bin contents of a histogram as a numpy array
+
+    Input:
+        - histo:
+            TH1 or TH2, input histogram
+        - sumw2:
+            bool, if True, return the sum of squared weights instead of the bin contents
+            (the bin contents are returned if the sum of squared weights is not stored)
+
+    Output:
+        - contents:
+            numpy array, bin contents including underflow and overflow bins,
+            with shape (nbinsY+2, nbinsX+2) for TH2
+    '''
+    if sumw2 and histo.GetSumw2N() > 0:
+        contents = np.frombuffer(histo.GetSumw2().GetArray(), dtype=np.float64, count=histo.GetNcells())
+    else:
+        dtype = next((dtype for array_class, dtype in _HIST_ARRAY_DTYPES.items()
+                      if histo.InheritsFrom(array_class)), None)
+        if dtype is None:
+            raise TypeError(f'Histogram {histo.GetName()} of class {histo.ClassName()} has no supported bin array')
+        contents = np.frombuffer(histo.GetArray(), dtype=dtype, count=histo.GetNcells())
+    if histo.GetDimension() == 2:
+        contents = contents.reshape(histo.GetNbinsY()+2, histo.GetNbinsX()+2)
+    return contents
+
+def set_hist_content(histo, contents, errors=None):
+    '''
+    Set the bin contents (and errors) of a TH1 writing directly into its buffers
+
+    Input:
+        - histo:
+            TH1, histogram to fill
+        - contents:
+            numpy array, bin contents without underflow and overflow bins
+        - errors:
+            numpy array, bin errors without underflow and overflow bins
+            (default: None, errors are not set)
+    '''
+    get_hist_array(histo)[1:-1] = contents
+    if errors is not None:
+        if histo.GetSumw2N() == 0:
+            histo.Sumw2()
+        get_hist_array(histo, sumw2=True)[1:-1] = np.square(errors)
+    histo.SetEntries(len(contents))
+
+def get_axis_edges(axis):
+    '''
+    Get the bin edges of an axis as a numpy array
+
+    Input:
+        - axis:
+            TAxis, input axis
+
+    Output:
+        - edges:
+            numpy array, bin edges (nbins+1 values)
+    '''
+    if axis.IsVariableBinSize():
+        return np.frombuffer(axis.GetXbins().GetArray(), dtype=np.float64, count=axis.GetNbins()+1).copy()
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins()+1)
+
+def find_bins(axis, values):
+    '''
+    Find the bins of an array of values, with the same convention as TAxis::FindBin
+
+    Input:
+        - axis:
+            TAxis, input axis
+        - values:
+            list or numpy array of floats, values to look up
+
+    Output:
+        - bins:
+            numpy array of ints, bin numbers (0 for underflow, nbins+1 for overflow)
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    nbins, xmin, xmax = axis.GetNbins(), axis.GetXmin(), axis.GetXmax()
+    if axis.IsVariableBinSize():
+        return np.searchsorted(get_axis_edges(axis), values, side='right')
+    bins = 1 + np.floor(nbins * (values - xmin) / (xmax - xmin)).astype(int)
+    bins[values < xmin] = 0
+    bins[values >= xmax] = nbins + 1
+    return bins
+
+def get_proj_means(contents, sumw2, centers):
+    '''
+    Compute the mean values of the projections of a TH2 along its y axis
+
+    Input:
+        - contents:
+            numpy array, bin contents with shape (nbinsY, nprojections)
+        - sumw2:
+            numpy array, sum of squared weights with the same shape as contents
+        - centers:
+            numpy array, bin centers of the y axis
+
+    Output:
+        - means:
+            numpy array, mean value of each projection (0 for empty projections)
+        - means_unc:
+            numpy array, uncertainty of the mean value of each projection
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sum_weights = contents.sum(axis=0)
+        means = np.einsum('y,yc->c', centers, contents) / sum_weights
+        variances = np.einsum('y,yc->c', centers**2, contents) / sum_weights - means**2
+        eff_entries = sum_weights**2 / sumw2.sum(axis=0)
+        means_unc = np.sqrt(np.clip(variances, 0, None) / eff_entries)
+    return np.nan_to_num(means), np.nan_to_num(means_unc)
+
 def get_vn_versus_mass(thnSparse, inv_mass_bins, mass_axis, vn_axis, debug=False):
     '''
     Project vn versus mass
@@ -28,6 +175,8 @@ def get_vn_versus_mass(thnSparse, inv_mass_bins, mass_axis, vn_axis, debug=False
         - hist_mass_proj:
             TH1D, histogram with vn as a function of mass
     '''
+    import ROOT # pylint: disable=import-outside-toplevel
+
     hist_vn_proj = thnSparse.Projection(vn_axis, mass_axis)
     hist_mass_proj = thnSparse.Projection(mass_axis)
     hist_mass_proj.Reset()
@@ -37,14 +186,18 @@ def get_vn_versus_mass(thnSparse, inv_mass_bins, mass_axis, vn_axis, debug=False
     if debug:
         outfile = ROOT.TFile('debug.root', 'RECREATE')
 
-    for i in range(hist_mass_proj.GetNbinsX()):
-        bin_low = hist_vn_proj.GetXaxis().FindBin(invmass_bins[i])
-        bin_high = hist_vn_proj.GetXaxis().FindBin(invmass_bins[i+1])
-        profile = hist_vn_proj.ProfileY(f'profile_{bin_low}_{bin_high}', bin_low, bin_high)
-        mean_sp = profile.GetMean()
-        mean_sp_err = profile.GetMeanError()
-        hist_mass_proj.SetBinContent(i+1, mean_sp)
-        hist_mass_proj.SetBinError(i+1, mean_sp_err)
+    # read the TH2 contents once and compute the vn mean in each mass bin with numpy
+    vn_edges = get_axis_edges(hist_vn_proj.GetYaxis())
+    vn_centers = 0.5 * (vn_edges[1:] + vn_edges[:-1])
+    bins = find_bins(hist_vn_proj.GetXaxis(), invmass_bins)
+    bin_low, bin_high = bins[:-1], bins[1:]
+    # sum the (inclusive) ranges of mass bins with cumulative sums, ranges of adjacent bins overlap
+    mass_projs = []
+    for hist_array in (get_hist_array(hist_vn_proj)[1:-1, :], get_hist_array(hist_vn_proj, sumw2=True)[1:-1, :]):
+        cumul_array = np.concatenate((np.zeros((hist_array.shape[0], 1)), np.cumsum(hist_array, axis=1)), axis=1)
+        mass_projs.append(cumul_array[:, bin_high+1] - cumul_array[:, bin_low])
+    mean_sp, mean_sp_err = get_proj_means(mass_projs[0], mass_projs[1], vn_centers)
+    set_hist_content(hist_mass_proj, mean_sp, mean_sp_err)
 
     if debug:
         hist_vn_proj.Write()
@@ -76,52 +229,58 @@ def get_resolution(dets, det_lables, cent_min_max):
         - histo_reso_delta_cent:
             TH1D, histogram with the resolution value as a function of centrality for CentMin-CentMax
     '''
-    histo_projs, histo_means, histo_means_deltacent = [], [], []
+    import ROOT # pylint: disable=import-outside-toplevel
+
+    histo_means, histo_means_deltacent = [], []
+    # mean values of the projections, (detector, centrality bin)
+    proj_means = np.zeros((len(dets), cent_min_max[1]-cent_min_max[0]))
+    proj_means_deltacent = np.zeros(len(dets))
 
     # collect the qvecs and prepare histo for mean and resolution
-    for _, (det, det_label) in enumerate(zip(dets, det_lables)):
+    for idet, (det, det_label) in enumerate(zip(dets, det_lables)):
         print(f'Processing {det_label}')
+        # read the TH2 contents once, projections are computed with numpy
+        contents = get_hist_array(det)[1:-1, :]
+        sumw2 = get_hist_array(det, sumw2=True)[1:-1, :]
+        proj_edges = get_axis_edges(det.GetYaxis())
+        proj_centers = 0.5 * (proj_edges[1:] + proj_edges[:-1])
         # th1 for mean 1% centrality bins
         histo_means.append(ROOT.TH1F('', '', cent_min_max[1]-cent_min_max[0], cent_min_max[0], cent_min_max[1]))
         histo_means[-1].SetDirectory(0)
         histo_means[-1].SetName(f'proj_{det_label}_mean')
         # th1 for mean CentMin-CentMax
-        histo_projs.append([])
-        hist_proj_dummy = det.ProjectionY(f'proj_{det.GetName()}_mean_deltacent',
-                                          det.GetXaxis().FindBin(cent_min_max[0]),
-                                          det.GetXaxis().FindBin(cent_min_max[1])-1)
         histo_means_deltacent.append(ROOT.TH1F('', '', 1, cent_min_max[0], cent_min_max[1]))
         histo_means_deltacent[-1].SetDirectory(0)
         histo_means_deltacent[-1].SetName(f'proj_{det_label}_mean_deltacent')
 
         # Set mean values for CentMin-CentMax
-        histo_means_deltacent[-1].SetBinContent(1, hist_proj_dummy.GetMean())
-        histo_means_deltacent[-1].SetBinError(1, hist_proj_dummy.GetMeanError())
-        del hist_proj_dummy
-
-        # collect projections 1% centrality bins
-        for cent in range(cent_min_max[0], cent_min_max[1]):
-            bin_cent = det.GetXaxis().FindBin(cent) # common binning
-            histo_projs[-1].append(det.ProjectionY(f'proj_{det_label}_{cent}',
-                                                          bin_cent, bin_cent))
-        # Set mean values for 1% centrality bins
-        for ihist, _ in enumerate(histo_projs[-1]):
-            histo_means[-1].SetBinContent(ihist+1, histo_projs[-1][ihist].GetMean())
+        cent_axis = det.GetXaxis()
+        cent_bin_min = cent_axis.FindBin(cent_min_max[0])
+        cent_bin_max = cent_axis.FindBin(cent_min_max[1])
+        mean_deltacent, mean_deltacent_unc = get_proj_means(
+            contents[:, cent_bin_min:cent_bin_max].sum(axis=1, keepdims=True),
+            sumw2[:, cent_bin_min:cent_bin_max].sum(axis=1, keepdims=True),
+            proj_centers)
+        proj_means_deltacent[idet] = mean_deltacent[0]
+        histo_means_deltacent[-1].SetBinContent(1, mean_deltacent[0])
+        histo_means_deltacent[-1].SetBinError(1, mean_deltacent_unc[0])
+
+        # Set mean values for 1% centrality bins (common binning)
+        cent_bins = find_bins(cent_axis, np.arange(cent_min_max[0], cent_min_max[1]))
+        proj_means[idet], _ = get_proj_means(contents[:, cent_bins], sumw2[:, cent_bins], proj_centers)
+        set_hist_content(histo_means[-1], proj_means[idet])
 
     # Compute resolution for 1% centrality bins
     histo_reso = ROOT.TH1F('histo_reso', 'histo_reso',
                            cent_min_max[1]-cent_min_max[0],
                            cent_min_max[0], cent_min_max[1])
     histo_reso.SetDirectory(0)
-    for icent in range(cent_min_max[0], cent_min_max[1]):
-        reso = compute_resolution([histo_means[i].GetBinContent(icent-cent_min_max[0]+1) for i in range(len(dets))])
-        centbin = histo_reso.GetXaxis().FindBin(icent)
-        histo_reso.SetBinContent(centbin, reso)
+    set_hist_content(histo_reso, _compute_resolution_vec(proj_means.T))
 
     # Compute resolution for CentMin-CentMax
     histo_reso_delta_cent = ROOT.TH1F('histo_reso_delta_cent', 'histo_reso_delta_cent',
                                       1, cent_min_max[0], cent_min_max[1])
-    res_deltacent = compute_resolution([histo_means_deltacent[i].GetBinContent(1) for i in range(len(dets))])
+    res_deltacent = compute_resolution(proj_means_deltacent)
     histo_reso_delta_cent.SetBinContent(1, res_deltacent)
     histo_reso_delta_cent.SetDirectory(0)
 
@@ -145,6 +304,8 @@ def getListOfHisots(an_res_file, wagon_id, vn_method):
         - correct_histo_labels:
             list of strings, list of detector labels
     '''
+    import ROOT # pylint: disable=import-outside-toplevel
+
     infile_path = f'hf-task-flow-charm-hadrons'
     if wagon_id:
         infile_path = f'{infile_path}_id{wagon_id}'
@@ -157,30 +318,70 @@ def getListOfHisots(an_res_file, wagon_id, vn_method):
 
     infile = ROOT.TFile(an_res_file, 'READ')
     directory = infile.GetDirectory(infile_path)
-    histos = [key.ReadObj() for key in directory.GetListOfKeys()]
-    for histo in histos:
-        histo.SetDirectory(0)
-    pairs = [key.GetName() for key in directory.GetListOfKeys()]
+    # walk the key list once and keep only the latest cycle of each histogram,
+    # the histograms are read only for the pairs used in the triplets
+    keys, pairs, seen_pairs = [], [], set()
+    for key in directory.GetListOfKeys():
+        if key.GetName() in seen_pairs:
+            continue
+        seen_pairs.add(key.GetName())
+        pairs.append(key.GetName())
+        keys.append(key)
+
+    # index pairs by detector A to find the triplets of pairs (AB, AC, BC) directly,
+    # A must be a known detector while B and C are the rest of the pair name
+    pairs_by_det = defaultdict(list)
+    pair_idx = {pair: ipair for ipair, pair in enumerate(pairs)}
+    for ipair, pair in enumerate(pairs):
+        for pair_pattern in _RESO_PAIR_PATTERNS[prefix]:
+            pair_match = pair_pattern.match(pair)
+            if pair_match and (pair_match['det'], ipair) not in pairs_by_det[pair_match['detA']]:
+                pairs_by_det[pair_match['detA']].append((pair_match['det'], ipair))
 
-    # generate triplets of pairs (AB, AC, BC)
     triplets = []
-    detsA = ['FT0c', 'FT0a', 'FV0a', 'TPCpos', 'FT0m', 'TPCneg']
-    triplets = list(combinations(pairs, 3))
-    histo_triplets = list(combinations(histos, 3))
-    correct_histo_triplets = []
-    correct_histo_labels = []
-    for i, triplet in enumerate(triplets):
-        for detA in detsA:
-            detB = triplet[0].replace(prefix, '').replace(detA, '')
-            detC = triplet[1].replace(prefix, '').replace(detA, '')
-            if (detA in triplet[0] and detA in triplet[1]) and \
-               (detB in triplet[0] and detB in triplet[2]) and \
-               (detC in triplet[1] and detC in triplet[2]):
-                correct_histo_triplets.append(histo_triplets[i])
-                correct_histo_labels.append((detA, detB, detC))
+    for detA in _RESO_DETS:
+        for (detB, ipair_ab), (detC, ipair_ac) in combinations(pairs_by_det[detA], 2):
+            for pair_bc in (f'{prefix}{detB}{detC}', f'{prefix}{detC}{detB}'):
+                if pair_idx.get(pair_bc, -1) > ipair_ac:
+                    triplets.append(((ipair_ab, ipair_ac, pair_idx[pair_bc]), (detA, detB, detC)))
+                    break
+    triplets.sort(key=lambda triplet: triplet[0])
+
+    histos = {}
+    for ipairs, _ in triplets:
+        for ipair in ipairs:
+            if ipair not in histos:
+                histos[ipair] = keys[ipair].ReadObj()
+                histos[ipair].SetDirectory(0)
+    correct_histo_triplets = [tuple(histos[ipair] for ipair in ipairs) for ipairs, _ in triplets]
+    correct_histo_labels = [labels for _, labels in triplets]
 
     return correct_histo_triplets, correct_histo_labels
 
+def _compute_resolution_vec(means):
+    '''
+    Compute resolution for SP or EP method for several centrality bins at once
+
+    Input:
+        - means:
+            numpy array, mean values of the projections with shape (ncent, nsub),
+            nsub being 1 or 3
+
+    Output:
+        - resolution:
+            numpy array, resolution values with shape (ncent,) (0 for non-positive values)
+    '''
+    means = np.asarray(means, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if means.shape[1] == 1:
+            resolution = means[:, 0]
+        elif means.shape[1] == 3:
+            resolution = (means[:, 0] * means[:, 1]) / np.where(means[:, 2] != 0, means[:, 2], np.nan)
+        else:
+            print('ERROR: dets must be a list of 2 or 3 subsystems')
+            sys.exit(1)
+        return np.where(resolution > 0, np.sqrt(resolution), 0.)
+
 def compute_resolution(subMean):
     '''
     Compute resolution for SP or EP method
@@ -193,24 +394,7 @@ def compute_resolution(subMean):
         - resolution:
             float, resolution value
     '''
-    print(subMean)
-    if len(subMean) == 1:
-        resolution =  subMean[0]
-        if resolution <= 0:
-            return 0
-        else:
-            return np.sqrt(resolution)
-    elif len(subMean) == 3:
-        print('3 subsystems')
-        resolution = (subMean[0] * subMean[1]) / subMean[2] if subMean[2] != 0 else 0
-        if resolution <= 0:
-            return 0
-        else:
-            print(resolution, np.sqrt(resolution))
-            return np.sqrt(resolution)
-    else:
-        print('ERROR: dets must be a list of 2 or 3 subsystems')
-        sys.exit(1)
+    return float(_compute_resolution_vec(np.asarray(subMean, dtype=np.float64)[None, :])[0])
 
 def get_centrality_bins(centrality):
     '''
@@ -226,33 +410,61 @@ def get_centrality_bins(centrality):
         - cent_label:
             str, centrality label
     '''
-    if centrality == 'k010':
-        return '0_10', [0, 10]
-    if centrality == 'k020':
-        return '0_20', [0, 20]
-    if centrality == 'k2030':
-        return '20_30', [20, 30]
-    elif centrality == 'k3040':
-        return '30_40', [30, 40]
-    elif centrality == 'k3050':
-        return '30_50', [30, 50]
-    elif centrality == 'k4050':
-        return '40_50', [40, 50]
-    elif centrality == 'k2060':
-        return '20_60', [20, 60]
-    elif centrality == 'k4060':
-        return '40_60', [40, 60]
-    elif centrality == 'k6070':
-        return '60_70', [60, 70]
-    elif centrality == 'k6080':
-        return '60_80', [60, 80]
-    elif centrality == 'k7080':
-        return '70_80', [70, 80]
-    elif centrality == 'k0100':
-        return '0_100', [0, 100]
-    else:
+    if centrality not in _CENT_BINS:
         print(f"ERROR: cent class \'{centrality}\' is not supported! Exit")
-    sys.exit()
+        sys.exit()
+    cent_label, cent_bins = _CENT_BINS[centrality]
+    return cent_label, list(cent_bins)
+
+@functools.lru_cache(maxsize=64)
+def _read_reso_hist_array(reso_file_path, hist_name, mtime): # pylint: disable=unused-argument
+    '''
+    Read a resolution TH2 from a file path with uproot, the modification time
+    is part of the cache key so that rewritten files are read again
+    '''
+    import uproot # pylint: disable=import-outside-toplevel
+
+    with uproot.open(reso_file_path) as reso_file:
+        histo = reso_file[hist_name]
+        contents = np.asarray(histo.values(flow=True), dtype=np.float64).T[1:-1, :]
+        cent_edges = histo.axis(0).edges()
+        proj_centers = histo.axis(1).centers()
+    return contents, cent_edges, proj_centers
+
+def get_reso_hist_array(reso_file, hist_name):
+    '''
+    Get the contents of a resolution TH2 as numpy arrays
+
+    Input:
+        - reso_file:
+            TFile or str, resolution file (or its path, read with uproot>=4; local files are cached
+            until modified)
+        - hist_name:
+            str, full path of the histogram in the resolution file
+
+    Output:
+        - contents:
+            numpy array, bin contents with shape (nbinsY, nbinsX+2)
+            (underflow and overflow bins only along the centrality axis)
+        - cent_edges:
+            numpy array, bin edges of the centrality axis
+        - proj_centers:
+            numpy array, bin centers of the y axis
+    '''
+    if isinstance(reso_file, (str, os.PathLike)):
+        reso_file_path = os.fspath(reso_file)
+        if os.path.isfile(reso_file_path):
+            return _read_reso_hist_array(reso_file_path, hist_name, os.path.getmtime(reso_file_path))
+        # remote files are not cached
+        return _read_reso_hist_array.__wrapped__(reso_file_path, hist_name, None)
+
+    # already open TFile
+    dir_name, histo_name = hist_name.rsplit('/', 1)
+    histo = reso_file.GetDirectory(dir_name).GetKey(histo_name).ReadObj()
+    contents = get_hist_array(histo)[1:-1, :].astype(np.float64)
+    cent_edges = get_axis_edges(histo.GetXaxis())
+    proj_edges = get_axis_edges(histo.GetYaxis())
+    return contents, cent_edges, 0.5 * (proj_edges[1:] + proj_edges[:-1])
 
 def compute_r2(reso_file, wagon_id, cent_min, cent_max, detA, detB, detC, vn_method):
     '''
@@ -260,7 +472,8 @@ def compute_r2(reso_file, wagon_id, cent_min, cent_max, detA, detB, detC, vn_met
     
     Input:
         - reso_file:
-            TFile, resolution file
+            TFile or str, resolution file (or its path, read with uproot>=4 and cached
+            until the file is modified, useful when compute_r2 is called many times)
         - wagon_id:
             str, wagon ID
         - cent_min:
@@ -288,23 +501,16 @@ def compute_r2(reso_file, wagon_id, cent_min, cent_max, detA, detB, detC, vn_met
     else:
         hist_name = f'hf-task-flow-charm-hadrons{wagon_id}/spReso/hSpReso'
 
-    detA_detB = reso_file.Get(f'{hist_name}{detA}{detB}')
-    detA_detC = reso_file.Get(f'{hist_name}{detA}{detC}')
-    detB_detC = reso_file.Get(f'{hist_name}{detB}{detC}')
-
-    cent_bin_min = detA_detB.GetXaxis().FindBin(cent_min)
-    cent_bin_max = detA_detB.GetXaxis().FindBin(cent_max)
-
-    proj_detA_detB = detA_detB.ProjectionY(f'{hist_name}{detA}{detB}_proj{cent_min}_{cent_max}',
-                                           cent_bin_min, cent_bin_max)
-    proj_detA_detC = detA_detC.ProjectionY(f'{hist_name}{detA}{detC}_proj{cent_min}_{cent_max}',
-                                           cent_bin_min, cent_bin_max)
-    proj_detB_detC = detB_detC.ProjectionY(f'{hist_name}{detB}{detC}_proj{cent_min}_{cent_max}',
-                                           cent_bin_min, cent_bin_max)
-
-    average_detA_detB = proj_detA_detB.GetMean()
-    average_detA_detC = proj_detA_detC.GetMean()
-    average_detB_detC = proj_detB_detC.GetMean()
+    hist_arrays = [get_reso_hist_array(reso_file, f'{hist_name}{dets_pair}')
+                   for dets_pair in (f'{detA}{detB}', f'{detA}{detC}', f'{detB}{detC}')]
+    # the centrality binning is common to all the pairs, take it from AB
+    cent_edges = hist_arrays[0][1]
+    cent_bin_min, cent_bin_max = np.searchsorted(cent_edges, [cent_min, cent_max], side='right')
+    averages = []
+    for contents, _, proj_centers in hist_arrays:
+        proj = contents[:, cent_bin_min:cent_bin_max+1].sum(axis=1)
+        averages.append((proj * proj_centers).sum() / proj.sum() if proj.sum() != 0 else 0)
+    average_detA_detB, average_detA_detC, average_detB_detC = averages
 
     reso = (average_detA_detB * average_detA_detC) / average_detB_detC if average_detB_detC != 0 else -999
     reso = np.sqrt(reso) if reso > 0 else -999
@@ -329,19 +535,30 @@ def get_invmass_vs_deltaphi(thnSparse, deltaphiaxis, invmassaxis):
         - hist_invMass_out:
             TH1D, histogram with invariant mass for out-of-plane
     ''' 
-    thn_inplane = thnSparse.Clone('thn_inplane')
-    thn_outplane = thnSparse.Clone('thn_outplane')
-    hist_cosDeltaPhi_inplane = thn_inplane.Projection(deltaphiaxis, invmassaxis)
-    hist_cosDeltaPhi_outplane = thn_outplane.Projection(deltaphiaxis, invmassaxis)
-    # In-plane (|cos(deltaphi)| < pi/4)
-    hist_cosDeltaPhi_inplane.GetYaxis().SetRangeUser(0, 1)
-    hist_invMass_in = hist_cosDeltaPhi_inplane.ProjectionX()
-    # Out-of-plane (|cos(deltaphi)| > pi/4)
-    hist_cosDeltaPhi_outplane.GetYaxis().SetRangeUser(-1, 0)
-    hist_invMass_out = hist_cosDeltaPhi_outplane.ProjectionX()
+    import ROOT # pylint: disable=import-outside-toplevel
+
+    deltaphi_axis = thnSparse.GetAxis(deltaphiaxis)
+    # save the range of the caller on the deltaphi axis to restore it after the projections
+    deltaphi_range = (deltaphi_axis.GetFirst(), deltaphi_axis.GetLast())
+    deltaphi_has_range = deltaphi_axis.TestBit(ROOT.TAxis.kAxisRange)
+    # In-plane (|cos(deltaphi)| < pi/4), within the range of the caller
+    deltaphi_axis.SetRangeUser(0, 1)
+    deltaphi_axis.SetRange(max(deltaphi_axis.GetFirst(), deltaphi_range[0]),
+                           min(deltaphi_axis.GetLast(), deltaphi_range[1]))
+    hist_invMass_in = thnSparse.Projection(invmassaxis)
+    hist_invMass_in.SetName(f'{thnSparse.GetName()}_invmass_inplane')
+    # Out-of-plane (|cos(deltaphi)| > pi/4), within the range of the caller
+    deltaphi_axis.SetRangeUser(-1, 0)
+    deltaphi_axis.SetRange(max(deltaphi_axis.GetFirst(), deltaphi_range[0]),
+                           min(deltaphi_axis.GetLast(), deltaphi_range[1]))
+    hist_invMass_out = thnSparse.Projection(invmassaxis)
+    hist_invMass_out.SetName(f'{thnSparse.GetName()}_invmass_outplane')
+    if deltaphi_has_range:
+        deltaphi_axis.SetRange(*deltaphi_range)
+    else:
+        deltaphi_axis.SetRange(0, 0)
     hist_invMass_in.SetLineColor(ROOT.kRed)
-    del thn_inplane, thn_outplane, hist_cosDeltaPhi_inplane, hist_cosDeltaPhi_outplane
-    
+
     return hist_invMass_in, hist_invMass_out
 
 def get_vnfitter_results(vnFitter, secPeak, useRefl):
@@ -397,6 +614,8 @@ def get_vnfitter_results(vnFitter, secPeak, useRefl):
             fMassRflFunc: mass reflection function
             fMassBkgRflFunc: mass background reflection function
     '''
+    import ctypes # pylint: disable=import-outside-toplevel
+
     vn_results = {}
     vn_results['vn'] = vnFitter.GetVn()
     vn_results['vnUnc'] = vnFitter.GetVnUncertainty()
@@ -423,15 +642,15 @@ def get_vnfitter_results(vnFitter, secPeak, useRefl):
     vn_results['sgnUnc'] = sgnUnc.value
 
     if secPeak:
-        vn_results['secPeakMeanMass'] = vn_results['fTotFuncMass'].GetParameter(vn_results['fTotFuncMass'].GetParName(6))
+        vn_results['secPeakMeanMass'] = vn_results['fTotFuncMass'].GetParameter(6)
         vn_results['secPeakMeanMassUnc'] = vn_results['fTotFuncMass'].GetParError(6)
-        vn_results['secPeakSigmaMass'] = vn_results['fTotFuncMass'].GetParameter(vn_results['fTotFuncMass'].GetParName(7))
+        vn_results['secPeakSigmaMass'] = vn_results['fTotFuncMass'].GetParameter(7)
         vn_results['secPeakSigmaMassUnc'] = vn_results['fTotFuncMass'].GetParError(7)
-        vn_results['secPeakMeanVn'] = vn_results['fTotFuncVn'].GetParameter(vn_results['fTotFuncVn'].GetParName(6))
+        vn_results['secPeakMeanVn'] = vn_results['fTotFuncVn'].GetParameter(6)
         vn_results['secPeakMeanVnUnc'] = vn_results['fTotFuncVn'].GetParError(6)
-        vn_results['secPeakSigmaVn'] = vn_results['fTotFuncVn'].GetParameter(vn_results['fTotFuncVn'].GetParName(7))
+        vn_results['secPeakSigmaVn'] = vn_results['fTotFuncVn'].GetParameter(7)
         vn_results['secPeakSigmaVnUnc'] = vn_results['fTotFuncVn'].GetParError(7)
-        vn_results['vnSecPeak'] = vn_results['fTotFuncVn'].GetParameter(vn_results['fTotFuncVn'].GetParName(11))
+        vn_results['vnSecPeak'] = vn_results['fTotFuncVn'].GetParameter(11)
         vn_results['vnSecPeakUnc'] = vn_results['fTotFuncVn'].GetParError(11)
 
     if useRefl:
@@ -448,42 +667,46 @@ def get_ep_vn(harmonic, nIn, nInUnc, nOut, nOutUnc, resol=1, corr=0):
         - harmonic:
             int, harmonic number
         - nIn:
-            float, number of in-plane particles
+            float or numpy array, number of in-plane particles
         - nInUnc:
-            float, uncertainty of the number of in-plane particles
+            float or numpy array, uncertainty of the number of in-plane particles
         - nOut:
-            float, number of out-of-plane particles
+            float or numpy array, number of out-of-plane particles
         - nOutUnc:
-            float, uncertainty of the number of out-of-plane particles
+            float or numpy array, uncertainty of the number of out-of-plane particles
         - resol:
-            float, resolution value (default: 1)
+            float or numpy array, resolution value (default: 1)
         - corr:
-            float, correlation between nIn and nOut (default: 1)
+            float or numpy array, correlation between nIn and nOut (default: 1)
 
     Output:
         - vn:
-            float, vn value
+            float or numpy array, vn value (0 for invalid inputs)
         - vnunc:
-            float, uncertainty of vn value
+            float or numpy array, uncertainty of vn value (0 for invalid inputs)
     '''
-    print(corr)
-    if nIn + nOut == 0:
+    nIn, nInUnc, nOut, nOutUnc = (np.asarray(n, dtype=np.float64) for n in (nIn, nInUnc, nOut, nOutUnc))
+    nTot = nIn + nOut
+    valid = nTot != 0
+    if not np.all(valid):
         print('\033[91m ERROR: nIn + nOut = 0. Return 0, 0 \033[0m')
-        return 0, 0
-    anis = (nIn - nOut) / (nIn + nOut)
-    anisDerivIn  = 2 * nOut / ((nIn + nOut)*(nIn + nOut))
-    anisDerivOut = -2 * nIn / ((nIn + nOut)*(nIn + nOut))
-    anisunc = anisDerivIn * anisDerivIn * nInUnc * nInUnc +\
-              anisDerivOut * anisDerivOut * nOutUnc * nOutUnc + \
-              2 * anisDerivIn * anisDerivOut * nInUnc * nOutUnc * corr
-    if anisunc < 0:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        anis = (nIn - nOut) / nTot
+        anisDerivIn  = 2 * nOut / (nTot * nTot)
+        anisDerivOut = -2 * nIn / (nTot * nTot)
+        anisunc = anisDerivIn * anisDerivIn * nInUnc * nInUnc +\
+                  anisDerivOut * anisDerivOut * nOutUnc * nOutUnc + \
+                  2 * anisDerivIn * anisDerivOut * nInUnc * nOutUnc * corr
+    if np.any(valid & (anisunc < 0)):
         print('\033[91m ERROR: anisunc < 0. Return 0, 0 \033[0m')
-        return 0, 0
-    anisunc = np.sqrt(anisunc)
+    valid &= anisunc >= 0
+    anisunc = np.sqrt(np.where(valid, anisunc, 0))
 
-    vn = (np.pi * anis) / (harmonic * harmonic * resol)
-    vnunc = (np.pi * anisunc) / (harmonic * harmonic * resol)
+    vn = np.where(valid, (np.pi * anis) / (harmonic * harmonic * resol), 0)
+    vnunc = np.where(valid, (np.pi * anisunc) / (harmonic * harmonic * resol), 0)
 
+    if vn.ndim == 0:
+        return float(vn), float(vnunc)
     return vn, vnunc
 
 def check_file_exists(file_path):
@@ -498,9 +721,7 @@ def check_file_exists(file_path):
         - file_exists:
             bool, if True, file exists
     '''
-    file_exists = False
-    if os.path.exists(file_path):
-        file_exists = True
+    file_exists = os.path.exists(file_path)
     return file_exists
 
 def check_histo_exists(file, histo_name):
@@ -509,7 +730,7 @@ def check_histo_exists(file, histo_name):
 
     Input:
         - file:
-            TFile, ROOT file
+            TFile or str, ROOT file (or its path)
         - histo_name:
             str, histogram name
 
@@ -517,13 +738,26 @@ def check_histo_exists(file, histo_name):
         - histo_exists:
             bool, if True, histogram exists
     '''
-    if not check_file_exists(file):
-        return False
-    file = ROOT.TFile(file, 'READ')
-    histo_exists = False
-    if file.Get(histo_name):
-        histo_exists = True
-    return histo_exists
+    import ROOT # pylint: disable=import-outside-toplevel
+
+    if isinstance(file, (str, os.PathLike)):
+        file = os.fspath(file)
+        if not check_file_exists(file):
+            return False
+        # the file is closed before returning so that it does not stay the current directory
+        infile = ROOT.TFile(file, 'READ')
+        histo_exists = _check_key_exists(infile, histo_name)
+        infile.Close()
+        return histo_exists
+    return _check_key_exists(file, histo_name)
+
+def _check_key_exists(file, histo_name):
+    '''
+    Check if the key of a histogram exists in an open file, without reading the histogram
+    '''
+    dir_name, _, key_name = histo_name.rpartition('/')
+    directory = file.GetDirectory(dir_name) if dir_name else file
+    return bool(directory) and bool(directory.GetKey(key_name))
 
 def getD0ReflHistos(reflFile, ptMins, ptMaxs):
     '''
@@ -545,33 +779,40 @@ def getD0ReflHistos(reflFile, ptMins, ptMaxs):
         - hMCRefl:
             list, reflection histograms of D0
     '''
+    import ROOT # pylint: disable=import-outside-toplevel
+
     hMCSgn, hMCRefl = [], []
     if not check_file_exists(reflFile):
         print(f'Error: reflection file {reflFile} does not exist! Turning off reflections usage')
-        return False
+        return False, [], []
     
     reflFile = ROOT.TFile(reflFile, 'READ')
 
-    for iPt, (ptMin, ptMax) in enumerate(zip(ptMins, ptMaxs)):
-        ptLowLabel = ptMin * 10
-        ptHighLabel = ptMax * 10
-
-        hMCSgn.append(reflFile.Get(f'hFDMass_{ptLowLabel:.0f}_{ptHighLabel:.0f}'))
-        print(f'hFDMass_{ptLowLabel}_{ptHighLabel}')
-        hMCSgn[iPt].Add(reflFile.Get(f'hPromptMass_{ptLowLabel:.0f}_{ptHighLabel:.0f}'))
-        if hMCSgn[iPt] == None:
-            print(f'hFDMass_{ptLowLabel:.0f}_{ptHighLabel:.0f} or hPromptMass_{ptLowLabel:.0f}_{ptHighLabel:.0f} not found! Turning off reflections usage')
-            return False
-        hMCSgn[iPt].SetName(f'histSgn_{iPt}')
-        hMCSgn[iPt].SetDirectory(0)
-
-        hMCRefl.append(reflFile.Get(f'hVarReflMass_{ptLowLabel:.0f}_{ptHighLabel:.0f}'))
-        if hMCRefl[iPt] == None:
-            print(f'hVarReflMass_{ptLowLabel:.0f}0_{ptHighLabel:.0f}0 not found! Turning off reflections usage')
-            return False
-        hMCRefl[iPt].SetName(f'histRfl_{iPt}')
-        hMCRefl[iPt].SetDirectory(0)
-
-    reflFile.Close()
+    try:
+        for iPt, (ptMin, ptMax) in enumerate(zip(ptMins, ptMaxs)):
+            ptLowLabel = ptMin * 10
+            ptHighLabel = ptMax * 10
+
+            # check the keys first, the histograms are read only if all of them exist
+            keyFD = reflFile.GetKey(f'hFDMass_{ptLowLabel:.0f}_{ptHighLabel:.0f}')
+            keyPrompt = reflFile.GetKey(f'hPromptMass_{ptLowLabel:.0f}_{ptHighLabel:.0f}')
+            keyRefl = reflFile.GetKey(f'hVarReflMass_{ptLowLabel:.0f}_{ptHighLabel:.0f}')
+            if not keyFD or not keyPrompt:
+                print(f'hFDMass_{ptLowLabel:.0f}_{ptHighLabel:.0f} or hPromptMass_{ptLowLabel:.0f}_{ptHighLabel:.0f} not found! Turning off reflections usage')
+                return False, [], []
+            if not keyRefl:
+                print(f'hVarReflMass_{ptLowLabel:.0f}_{ptHighLabel:.0f} not found! Turning off reflections usage')
+                return False, [], []
+
+            hMCSgn.append(keyFD.ReadObj())
+            hMCSgn[iPt].Add(keyPrompt.ReadObj())
+            hMCSgn[iPt].SetName(f'histSgn_{iPt}')
+            hMCSgn[iPt].SetDirectory(0)
+
+            hMCRefl.append(keyRefl.ReadObj())
+            hMCRefl[iPt].SetName(f'histRfl_{iPt}')
+            hMCRefl[iPt].SetDirectory(0)
+    finally:
+        reflFile.Close()
 
     return True, hMCSgn, hMCRefl